@@ -26,6 +26,10 @@ from datetime import datetime, timedelta
 import pyets2lib.scshelpers
 from pyets2lib.scsdefs import *
 
+from . import history
+from . import indexed
+from . import multicast
+from . import stats
 from . import web_server
 from .version import VERSION
 
@@ -38,20 +42,56 @@ GAME_TIME_BASE = datetime(1, 1, 1)
 # Used by conversion functions when the game gives a bad value
 BAD_VALUE = object()
 
+# Numeric fields to keep a history of, for the /history endpoint.
+# Set to () to disable the history.
+HISTORY_FIELDS = ('truck.speed', 'truck.engineRpm', 'truck.fuel')
+# One hour of samples
+HISTORY_LENGTH = 3600
+HISTORY_INTERVAL = 1.0
+
+# Send compact binary frames to a UDP multicast group. See multicast.py
+# for the frame format.
+UDP_ENABLED = False
+UDP_GROUP = '239.255.25.55'
+UDP_PORT = 25555
+# Maximum frames per second
+UDP_RATE = 30.0
+# Fields to send. None sends all channel fields that are numbers.
+UDP_FIELDS = (
+    'truck.speed',
+    'truck.engineRpm',
+    'truck.gear',
+    'truck.displayedGear',
+    'truck.fuel',
+    'truck.cruiseControlOn',
+    'truck.blinkerLeftOn',
+    'truck.blinkerRightOn',
+    'truck.lightsParkingOn',
+    'truck.lightsBeamLowOn',
+    'truck.lightsBeamHighOn',
+    'truck.parkBrakeOn',
+    'navigation.speedLimit',
+)
+
 logger_ = None
 init_params_ = None
 server_ = None
 server_thread_ = None
+udp_publisher_ = None
+udp_thread_ = None
 game_time_ = GAME_TIME_BASE
 delivery_time_ = GAME_TIME_BASE
+# Number of registered indices, per indexed channel
+registered_index_counts_ = {}
+stats_ = stats.TripStats()
 
-# NOTE: new_data indicator only works well with 1 client.
-# Need to track connection/session ids to handle multiple clients
-# and call notify_all().
+# sequence is increased on every update. Each client keeps track of
+# the last sequence number it was sent.
 shared_data_ = {
     'condition': threading.Condition(),
     'telemetry_data': {},
-    'new_data': False
+    'sequence': 0,
+    'history': None
 }
 
 # Only call these functions when shared_data is locked!
@@ -59,17 +99,21 @@ def set_shared_value(json0, json1, value):
     shared_data_['telemetry_data'][json0][json1] = value
 
 def shared_data_notify():
-    shared_data_['new_data'] = True
-    shared_data_['condition'].notify()
+    shared_data_['sequence'] += 1
+    shared_data_['condition'].notify_all()
 
 def telemetry_init(version, params):
-    global logger_
+    global logger_, init_params_
     logger_ = params.common.logger
     init_params_ = params
 
     logger_.info("Version %s", VERSION)
     
     init_shared_data()
+    if HISTORY_FIELDS:
+        shared_data_['history'] = history.HistoryStore(HISTORY_FIELDS,
+                                                       HISTORY_LENGTH,
+                                                       HISTORY_INTERVAL)
     shared_data_['telemetry_data']['game']['gameName'] = init_params_.common.game_id.upper().replace('EUT2', 'ETS2')
     shared_data_['telemetry_data']['game']['version'] = init_params_.common.game_name.split(' ')[-1]
 
@@ -77,21 +121,40 @@ def telemetry_init(version, params):
     init_params_.register_for_event(SCS_TELEMETRY_EVENT_started, event_cb, None)
     init_params_.register_for_event(SCS_TELEMETRY_EVENT_paused, event_cb, None)
     
+    registered_index_counts_.clear()
     for channel in SCS_CHANNELS:
         if not hasattr(channel, 'json_path'):
             continue
         if channel.indexed:
-            index = 0
-        else:
-            index = None
-        init_params_.register_for_channel(channel, channel_cb, index)
+            # Registered when the index count is known, in event_cb()
+            continue
+        init_params_.register_for_channel(channel, channel_cb, None)
         
     start_server()
 
+# Only call from telemetry_init() or an event callback!
+def register_indexed_channel(channel, count):
+    count = min(count, indexed.MAX_INDEX_COUNT)
+    # Indices are never unregistered. The game does not send values for
+    # indices above the current count.
+    for index in range(registered_index_counts_.get(channel, 0), count):
+        init_params_.register_for_channel(channel, channel_cb, index)
+    registered_index_counts_[channel] = max(
+        count, registered_index_counts_.get(channel, 0))
+    json_path = channel.json_path
+    shared_data_['telemetry_data'][json_path[0]][json_path[1]].set_count(count)
+
 def channel_cb(channel, index, value, context):
     global game_time_, delivery_time_
 
     with shared_data_['condition']:
+        if channel.indexed:
+            json_path = channel.json_path
+            shared_data_['telemetry_data'][json_path[0]][json_path[1]].set(
+                index, value)
+            shared_data_notify()
+            return
+
         # Optimize this?
         if channel == SCS_TELEMETRY_CHANNEL_game_time:
             game_time_ = GAME_TIME_BASE + timedelta(minutes=value)
@@ -103,6 +166,17 @@ def channel_cb(channel, index, value, context):
             set_shared_value('job', 'remainingTime',
                              json_time(
                                  GAME_TIME_BASE + remaining_time))
+            stats_.update_game_time(game_time_)
+        elif channel == SCS_TELEMETRY_TRUCK_CHANNEL_speed:
+            stats_.update_speed(value)
+        elif channel == SCS_TELEMETRY_TRUCK_CHANNEL_odometer:
+            stats_.update_odometer(value)
+        elif channel == SCS_TELEMETRY_TRUCK_CHANNEL_fuel:
+            stats_.update_fuel(value)
+        elif channel == SCS_TELEMETRY_TRUCK_CHANNEL_navigation_time:
+            stats_.update_navigation_time(value)
+        elif channel == SCS_TELEMETRY_CHANNEL_local_scale:
+            stats_.update_time_scale(value)
         elif channel == SCS_TELEMETRY_TRUCK_CHANNEL_dashboard_backlight:
             set_shared_value('truck', 'lightsDashboardOn', value > 0)
         elif channel == SCS_TELEMETRY_TRUCK_CHANNEL_cruise_control:
@@ -117,12 +191,16 @@ def channel_cb(channel, index, value, context):
             value = json_time(value)
 
         set_shared_value(channel.json_path[0], channel.json_path[1], value)
+        if shared_data_['history']:
+            shared_data_['history'].sample(shared_data_['telemetry_data'])
         shared_data_notify()
 
 def event_cb(event, event_info, context):
     global game_time_, delivery_time_
     if event == SCS_TELEMETRY_EVENT_configuration:
         with shared_data_['condition']:
+            if event_info['id'] == SCS_TELEMETRY_CONFIG_job:
+                stats_.reset()
             event_map = CONFIG_EVENT_MAP.get(event_info['id'])
             if event_map is not None:
                 for name, index, value in event_info['attributes']:
@@ -138,9 +216,18 @@ def event_cb(event, event_info, context):
                             # and calculate remaining time when game
                             # time changes.
                             delivery_time_ = value
+                            stats_.set_delivery_time(delivery_time_)
                         if isinstance(value, datetime):
                             value = json_time(value)
                         set_shared_value(json_path[0], json_path[1], value)
+            counts = { name: value
+                       for name, index, value in event_info['attributes'] }
+            for (config_id, name), channels in INDEX_COUNT_MAP.items():
+                if config_id == event_info['id']:
+                    # A configuration without the count, e.g. when the
+                    # trailer is detached, has no indices
+                    for channel in channels:
+                        register_indexed_channel(channel, counts.get(name, 0))
             shared_data_notify()
     elif event == SCS_TELEMETRY_EVENT_started:
         with shared_data_['condition']:
@@ -162,14 +249,41 @@ def start_server():
     server_thread_.name = "signalr server"
     server_thread_.start()
 
-    logger_.info("Started server on port %u" % server_.PORT_NUMBER)
+    logger_.info("Started server on port %u" % server_.server_address[1])
+
+    if UDP_ENABLED:
+        start_udp_publisher()
 
 def stop_server():
+    if udp_publisher_:
+        stop_udp_publisher()
     server_.shutdown()
     server_thread_.join()
     server_.server_close()
     logger_.info("Stopped server")
 
+def start_udp_publisher():
+    global udp_publisher_, udp_thread_
+    fields = UDP_FIELDS
+    if fields is None:
+        fields = [ '.'.join(channel.json_path) for channel in SCS_CHANNELS
+                   if hasattr(channel, 'json_path') and not channel.indexed ]
+    udp_publisher_ = multicast.MulticastPublisher(logger_, shared_data_,
+                                                  fields, UDP_GROUP, UDP_PORT,
+                                                  UDP_RATE)
+    udp_thread_ = threading.Thread(
+        target=run_and_log_exceptions(udp_publisher_.run))
+    udp_thread_.name = "udp publisher"
+    udp_thread_.start()
+
+    logger_.info("Sending UDP frames to %s:%u, layout id %08x",
+                 UDP_GROUP, UDP_PORT, udp_publisher_.layout_id)
+
+def stop_udp_publisher():
+    udp_publisher_.stop()
+    udp_thread_.join()
+    udp_publisher_.close()
+
 def run_and_log_exceptions(target):
     def runner():
         try:
@@ -186,7 +300,7 @@ def telemetry_shutdown():
     logger_.info("bye")
 
 def init_shared_data():
-    shared_data_['new_data'] = True
+    shared_data_['sequence'] += 1
     shared_data_['telemetry_data'] = {
         'game': {
             'connected': True,
@@ -329,8 +443,14 @@ def init_shared_data():
             'estimatedTime': json_time(GAME_TIME_BASE),
             'estimatedDistance': 0,
             'speedLimit': 80,
-        }
+        },
+        # Updated in place by stats_
+        'stats': stats_.data
     }
+    for channel in SCS_CHANNELS:
+        if hasattr(channel, 'json_path') and channel.indexed:
+            set_shared_value(channel.json_path[0], channel.json_path[1],
+                             indexed.IndexedValues(*channel.array_type))
 
 def json_time(dt):
     return dt.isoformat(timespec='seconds')+'Z'
@@ -436,6 +556,72 @@ SCS_TELEMETRY_TRUCK_CHANNEL_wipers.json_path = ('truck', 'wipersOn')
 SCS_TELEMETRY_TRUCK_CHANNEL_world_placement.json_path = ('truck', 'placement')
 SCS_TELEMETRY_TRUCK_CHANNEL_world_placement.conv_func = flatten_placement
 
+# Indexed channels. array_type holds the IndexedValues arguments.
+SCS_TELEMETRY_TRUCK_CHANNEL_hshifter_selector.json_path = ('truck', 'shifterSelector')
+SCS_TELEMETRY_TRUCK_CHANNEL_hshifter_selector.array_type = ('B', True)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_susp_deflection.json_path = ('trailer', 'wheelSuspDeflection')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_susp_deflection.array_type = ('f',)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_on_ground.json_path = ('trailer', 'wheelOnGround')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_on_ground.array_type = ('B', True)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_substance.json_path = ('trailer', 'wheelSubstance')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_substance.array_type = ('I',)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_velocity.json_path = ('trailer', 'wheelVelocity')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_velocity.array_type = ('f',)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_steering.json_path = ('trailer', 'wheelSteering')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_steering.array_type = ('f',)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_rotation.json_path = ('trailer', 'wheelRotation')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_rotation.array_type = ('f',)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_lift.json_path = ('trailer', 'wheelLift')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_lift.array_type = ('f',)
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_lift_offset.json_path = ('trailer', 'wheelLiftOffset')
+SCS_TELEMETRY_TRAILER_CHANNEL_wheel_lift_offset.array_type = ('f',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_susp_deflection.json_path = ('truck', 'wheelSuspDeflection')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_susp_deflection.array_type = ('f',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_on_ground.json_path = ('truck', 'wheelOnGround')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_on_ground.array_type = ('B', True)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_substance.json_path = ('truck', 'wheelSubstance')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_substance.array_type = ('I',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_velocity.json_path = ('truck', 'wheelVelocity')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_velocity.array_type = ('f',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_steering.json_path = ('truck', 'wheelSteering')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_steering.array_type = ('f',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_rotation.json_path = ('truck', 'wheelRotation')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_rotation.array_type = ('f',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_lift.json_path = ('truck', 'wheelLift')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_lift.array_type = ('f',)
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_lift_offset.json_path = ('truck', 'wheelLiftOffset')
+SCS_TELEMETRY_TRUCK_CHANNEL_wheel_lift_offset.array_type = ('f',)
+TRUCK_WHEEL_CHANNELS = (
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_susp_deflection,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_on_ground,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_substance,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_velocity,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_steering,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_rotation,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_lift,
+    SCS_TELEMETRY_TRUCK_CHANNEL_wheel_lift_offset,
+)
+TRAILER_WHEEL_CHANNELS = (
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_susp_deflection,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_on_ground,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_substance,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_velocity,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_steering,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_rotation,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_lift,
+    SCS_TELEMETRY_TRAILER_CHANNEL_wheel_lift_offset,
+)
+
+# Config attributes giving the number of indices of indexed channels
+INDEX_COUNT_MAP = {
+    (SCS_TELEMETRY_CONFIG_hshifter, SCS_TELEMETRY_CONFIG_ATTRIBUTE_selector_count):
+        (SCS_TELEMETRY_TRUCK_CHANNEL_hshifter_selector,),
+    (SCS_TELEMETRY_CONFIG_truck, SCS_TELEMETRY_CONFIG_ATTRIBUTE_wheel_count):
+        TRUCK_WHEEL_CHANNELS,
+    (SCS_TELEMETRY_CONFIG_trailer, SCS_TELEMETRY_CONFIG_ATTRIBUTE_wheel_count):
+        TRAILER_WHEEL_CHANNELS,
+}
+
 CONFIG_EVENT_MAP = {
     SCS_TELEMETRY_CONFIG_controls: {
         SCS_TELEMETRY_CONFIG_ATTRIBUTE_shifter_type: ('truck', 'shifterType'),
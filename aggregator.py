@@ -0,0 +1,291 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Convoy aggregator. Subscribes to the servers of several drivers and
+# serves the positions, speeds, jobs and navigation of all of them as
+# one document:
+#
+#   python3 aggregator.py [NAME=]HOST[:PORT] ... [--port <PORT>] [--rate <HZ>]
+#
+# GET /convoy returns all drivers. GET /convoy?since=<sequence> waits for
+# an update and only returns the drivers that changed after <sequence>.
+# If <sequence> is ahead of the aggregator, e.g. after a restart, all
+# drivers are returned immediately.
+
+import argparse
+import http
+import json
+import logging
+import math
+import threading
+import time
+
+try:
+    from . import web_server
+except ImportError:
+    # Run as a script
+    import web_server
+
+PORT_NUMBER = 25560
+# Published updates per second
+DEFAULT_RATE = 2.0
+# Port of the first simulated driver
+SIMULATION_PORT_NUMBER = 25600
+
+# Column name and JSON path in the telemetry data
+COLUMNS = (
+    ('placement', ('truck', 'placement')),
+    ('speed', ('truck', 'speed')),
+    ('job', ('job',)),
+    ('navigation', ('navigation',)),
+)
+
+class ConvoyTable:
+    """Latest values of all drivers, one row per driver.
+
+    Only call when shared_data is locked!
+    """
+    def __init__(self, names):
+        self.names_ = list(names)
+        self.rows_ = [ [None] * len(COLUMNS) for name in self.names_ ]
+        self.connected_ = [ False ] * len(self.names_)
+        # Sequence number of the last published change, per row
+        self.row_sequences_ = [ 0 ] * len(self.names_)
+        self.changed_ = set()
+
+    def update(self, index, telemetry_data):
+        row = self.rows_[index]
+        for column, (name, path) in enumerate(COLUMNS):
+            value = telemetry_data
+            for key in path:
+                value = value.get(key) if value is not None else None
+            if row[column] != value:
+                row[column] = value
+                self.changed_.add(index)
+        self.set_connected(index, True)
+
+    def set_connected(self, index, connected):
+        if self.connected_[index] != connected:
+            self.connected_[index] = connected
+            self.changed_.add(index)
+
+    def publish(self, sequence):
+        """Marks changed rows with sequence. Returns False if no row has
+        changed since the last call."""
+        if not self.changed_:
+            return False
+        for index in self.changed_:
+            self.row_sequences_[index] = sequence
+        self.changed_.clear()
+        return True
+
+    def document(self, sequence, since=None):
+        drivers = []
+        for index, name in enumerate(self.names_):
+            if since is not None and self.row_sequences_[index] <= since:
+                continue
+            driver = { 'index': index,
+                       'name': name,
+                       'connected': self.connected_[index] }
+            for column, (column_name, path) in enumerate(COLUMNS):
+                driver[column_name] = self.rows_[index][column]
+            drivers.append(driver)
+        return { 'sequence': sequence, 'drivers': drivers }
+
+class ConvoyHandler(web_server.SignalrHandler):
+    def do_signalr_comm(self):
+        if self.path.startswith('/convoy'):
+            self.read_data()
+            self.write_convoy()
+            return True
+        return super().do_signalr_comm()
+
+    def write_convoy(self):
+        since = self.parse_query().get('since')
+        try:
+            since = int(since[0]) if since else None
+        except ValueError:
+            self.write_response('', code=http.HTTPStatus.BAD_REQUEST)
+            return
+
+        shared_data = self.shared_data_
+        with shared_data['condition']:
+            if since is not None and since > shared_data['sequence']:
+                # The client has seen a sequence number from before a
+                # restart of the aggregator. Send everything, to resync.
+                since = None
+            if (since is not None and since == shared_data['sequence'] and
+                not self.stop_event_.is_set()):
+                shared_data['condition'].wait(10.0)
+            document = json.dumps(shared_data['convoy'].document(
+                shared_data['sequence'], since))
+        self.write_response(document)
+
+class ConvoyServer(web_server.SignalrHttpServer):
+    handler_class = ConvoyHandler
+
+class Aggregator:
+    def __init__(self, logger, upstreams, port, rate):
+        """upstreams: List of (name, host, port)"""
+        self.logger_ = logger
+        self.interval_ = 1.0 / rate
+        self.stop_event_ = threading.Event()
+        self.shared_data_ = {
+            'condition': threading.Condition(),
+            'telemetry_data': {},
+            'sequence': 0,
+            'history': None,
+            'convoy': ConvoyTable(name for name, host, port in upstreams)
+        }
+        self.subscribers_ = []
+        for index, (name, host, upstream_port) in enumerate(upstreams):
+            self.subscribers_.append(web_server.UpstreamSubscriber(
+                logger, host, upstream_port,
+                lambda data, index=index: self.on_data(index, data),
+                lambda index=index: self.on_disconnect(index)))
+        self.server_ = ConvoyServer(logger, self.shared_data_, port)
+
+    def on_data(self, index, telemetry_data):
+        with self.shared_data_['condition']:
+            self.shared_data_['convoy'].update(index, telemetry_data)
+
+    def on_disconnect(self, index):
+        with self.shared_data_['condition']:
+            self.shared_data_['convoy'].set_connected(index, False)
+
+    def publish(self):
+        # Limit the update rate, no matter how often the drivers' data
+        # changes
+        while not self.stop_event_.wait(self.interval_):
+            shared_data = self.shared_data_
+            with shared_data['condition']:
+                sequence = shared_data['sequence'] + 1
+                if shared_data['convoy'].publish(sequence):
+                    shared_data['sequence'] = sequence
+                    # SignalR clients get the full document
+                    shared_data['telemetry_data'] = (
+                        shared_data['convoy'].document(sequence))
+                    shared_data['condition'].notify_all()
+
+    def run(self):
+        threads = []
+        for subscriber in self.subscribers_:
+            threads.append(threading.Thread(target=subscriber.run))
+        threads.append(threading.Thread(target=self.publish))
+        for thread in threads:
+            thread.start()
+        try:
+            self.server_.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event_.set()
+            for subscriber in self.subscribers_:
+                subscriber.stop()
+            for thread in threads:
+                thread.join()
+            self.server_.shutdown()
+            self.server_.server_close()
+
+def simulate_driver(index, port, stop_event):
+    """Serves a truck driving in a circle, for testing the aggregator
+    without running the game."""
+    logger = logging.getLogger('simulation %u' % index)
+    shared_data = {
+        'condition': threading.Condition(),
+        'telemetry_data': {
+            'game': { 'connected': True },
+            'truck': { 'speed': 0, 'placement': {} },
+            'job': { 'sourceCity': 'Start %u' % index,
+                     'destinationCity': 'End %u' % index },
+            'navigation': { 'estimatedDistance': 0 },
+        },
+        'sequence': 0,
+        'history': None
+    }
+    server = web_server.SignalrHttpServer(logger, shared_data, port)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    start = time.monotonic()
+    while not stop_event.wait(0.1):
+        angle = (time.monotonic() - start) / 10.0 + index
+        with shared_data['condition']:
+            truck = shared_data['telemetry_data']['truck']
+            truck['speed'] = 80 + index
+            truck['placement'] = { 'x': 1000.0 * math.cos(angle),
+                                   'y': 0.0,
+                                   'z': 1000.0 * math.sin(angle),
+                                   'heading': angle,
+                                   'pitch': 0.0,
+                                   'roll': 0.0 }
+            shared_data['sequence'] += 1
+            shared_data['condition'].notify_all()
+    server.shutdown()
+    server_thread.join()
+    server.server_close()
+
+def parse_upstream(upstream):
+    name, _, address = upstream.rpartition('=')
+    host, port = web_server.parse_address(address)
+    return (name or address, host, port)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Combine the telemetry data of several "
+                    "pyets2_telemetry_servers.")
+    parser.add_argument('upstreams', nargs='*', metavar='[NAME=]HOST[:PORT]',
+                        help="Server of a driver")
+    parser.add_argument('--port', type=int, default=PORT_NUMBER,
+                        help="Port to serve on (default: %(default)s)")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help="Maximum updates per second "
+                             "(default: %(default)s)")
+    parser.add_argument('--simulate', type=int, default=0, metavar='N',
+                        help="Add N simulated drivers, on port %u and up" %
+                             SIMULATION_PORT_NUMBER)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    upstreams = [ parse_upstream(upstream) for upstream in args.upstreams ]
+    simulation_stop_event = threading.Event()
+    simulation_threads = []
+    for index in range(args.simulate):
+        port = SIMULATION_PORT_NUMBER + index
+        upstreams.append(('Simulated %u' % index, 'localhost', port))
+        thread = threading.Thread(
+            target=simulate_driver,
+            args=(index, port, simulation_stop_event))
+        thread.start()
+        simulation_threads.append(thread)
+    if not upstreams:
+        parser.error("No drivers given")
+
+    logger = logging.getLogger('aggregator')
+    logger.info("Serving %u drivers on port %u", len(upstreams), args.port)
+    try:
+        Aggregator(logger, upstreams, args.port, args.rate).run()
+    finally:
+        simulation_stop_event.set()
+        for thread in simulation_threads:
+            thread.join()
+
+if __name__ == '__main__':
+    main()
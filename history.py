@@ -0,0 +1,104 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Bounded history of numeric telemetry fields.
+#
+# All fields share one ring of sample times. The rings are allocated
+# up front, so memory use does not grow with the session length.
+#
+# NumPy is not available in the game's Python, so the buckets are
+# reduced with the C-level min()/max()/sum() on array slices instead.
+
+import bisect
+import time
+from array import array
+
+class HistoryStore:
+    def __init__(self, fields, length, interval):
+        """fields: Dotted JSON paths, e.g. 'truck.speed'
+        length: Number of samples to keep per field
+        interval: Minimum number of seconds between samples
+        """
+        self.length_ = length
+        self.interval_ = interval
+        self.paths_ = { field: tuple(field.split('.')) for field in fields }
+        self.times_ = array('d', bytes(8 * length))
+        self.values_ = { field: array('d', bytes(8 * length))
+                         for field in fields }
+        self.next_ = 0
+        self.count_ = 0
+        self.last_sample_time_ = float('-inf')
+
+    def fields(self):
+        return list(self.paths_)
+
+    def sample(self, telemetry_data, now=None):
+        """Stores the current field values, if the sample interval has passed."""
+        if now is None:
+            now = time.time()
+        if now - self.last_sample_time_ < self.interval_:
+            return
+        self.last_sample_time_ = now
+
+        pos = self.next_
+        for field, path in self.paths_.items():
+            value = telemetry_data
+            for key in path:
+                value = value[key]
+            self.values_[field][pos] = value
+        self.times_[pos] = now
+
+        self.next_ = (pos + 1) % self.length_
+        if self.count_ < self.length_:
+            self.count_ += 1
+
+    def query(self, field, since=None, points=300):
+        """Returns the samples of field, reduced into at most points buckets.
+
+        Raises KeyError if field is not recorded.
+        """
+        times = self._ordered(self.times_)
+        values = self._ordered(self.values_[field])
+
+        start = 0
+        if since is not None:
+            # Samples are stored in time order
+            start = bisect.bisect_left(times, since)
+        count = len(times) - start
+        points = min(points, count)
+
+        buckets = []
+        for i in range(points):
+            lo = start + i * count // points
+            hi = start + (i + 1) * count // points
+            chunk = values[lo:hi]
+            buckets.append({
+                'time': times[lo],
+                'min': min(chunk),
+                'max': max(chunk),
+                'mean': sum(chunk) / len(chunk),
+            })
+        return buckets
+
+    def _ordered(self, ring):
+        # Oldest sample first
+        if self.count_ < self.length_:
+            return ring[:self.count_]
+        return ring[self.next_:] + ring[:self.next_]
@@ -0,0 +1,71 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Storage for indexed channels, e.g. one value per wheel.
+
+import math
+from array import array
+
+# More wheels than any truck or trailer in the game
+MAX_INDEX_COUNT = 32
+
+class IndexedValues:
+    def __init__(self, typecode, is_bool=False):
+        """typecode: array.array typecode for the values
+        is_bool: Serialize the values as JSON booleans
+        """
+        self.values_ = array(typecode, bytes(array(typecode).itemsize *
+                                             MAX_INDEX_COUNT))
+        self.is_bool_ = is_bool
+        self.count_ = 0
+        self.json_ = []
+        self.changed_ = False
+
+    def set_count(self, count):
+        count = min(count, MAX_INDEX_COUNT)
+        if count != self.count_:
+            # Do not show the values of e.g. a previous trailer when the
+            # count grows again
+            for index in range(count, self.count_):
+                self.values_[index] = 0
+            self.count_ = count
+            self.changed_ = True
+
+    def set(self, index, value):
+        if index >= self.count_:
+            return
+        # The game can send Inf or NaN, which are not part of JSON and
+        # make the client parser fail. Keep the last good value instead.
+        if isinstance(value, float) and not math.isfinite(value):
+            return
+        if self.values_[index] != value:
+            self.values_[index] = value
+            self.changed_ = True
+
+    def to_json(self):
+        """Returns the values as a list. The list is only rebuilt if a
+        value has changed since the last call."""
+        if self.changed_:
+            if self.is_bool_:
+                self.json_ = [ v != 0 for v in self.values_[:self.count_] ]
+            else:
+                self.json_ = self.values_[:self.count_].tolist()
+            self.changed_ = False
+        return self.json_
@@ -0,0 +1,166 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Sends telemetry frames to a UDP multicast group, for simple LAN devices.
+#
+# Frame (little-endian):
+#   header: magic b'ETS2', version u8, pad u8, value count u16,
+#           layout id u32, sequence u32
+#   values: One value per field. bool is u8, int is i32 and float is f32.
+#           Dicts, e.g. placement, are sent as one value per key, in the
+#           key order of the layout.
+#
+# The layout id is the CRC-32 of the layout description, one
+# "<field>:<struct format>" or "<field>{<key>,...}:<struct format>" line
+# per field, so that receivers can detect a layout that does not match
+# their own.
+
+import socket
+import struct
+import threading
+import zlib
+
+FRAME_MAGIC = b'ETS2'
+FRAME_VERSION = 1
+HEADER = struct.Struct('<4sBxHII')
+# Values can change type, e.g. when the game sends an int for a float
+CONVERTERS = { '?': bool, 'i': int, 'f': float }
+
+def value_format(value):
+    # bool is a subclass of int, so check it first
+    if isinstance(value, bool):
+        return '?'
+    elif isinstance(value, int):
+        return 'i'
+    elif isinstance(value, float):
+        return 'f'
+    elif isinstance(value, dict):
+        formats = [ value_format(v) for v in value.values() ]
+        if None in formats:
+            return None
+        return ''.join(formats)
+    return None
+
+class MulticastPublisher:
+    def __init__(self, logger, shared_data, fields, group, port, rate):
+        """fields: Dotted JSON paths, e.g. 'truck.speed'. Fields that are
+        not numbers, booleans or dicts of those are skipped.
+        rate: Maximum number of frames per second
+        """
+        self.logger_ = logger
+        self.shared_data_ = shared_data
+        self.address_ = (group, port)
+        self.interval_ = 1.0 / rate
+        self.stop_event_ = threading.Event()
+        self.sequence_ = 0
+
+        # The layout is generated from the initial values
+        self.fields_ = []
+        formats = []
+        layout = []
+        telemetry_data = shared_data['telemetry_data']
+        for field in fields:
+            path = tuple(field.split('.'))
+            value = telemetry_data
+            for key in path:
+                value = value[key]
+            fmt = value_format(value)
+            if fmt is None:
+                self.logger_.warning("Cannot send %s over UDP", field)
+                continue
+            if isinstance(value, dict):
+                # Pack by key, in case later dicts are ordered differently
+                keys = tuple(value.keys())
+                layout.append('%s{%s}:%s' % (field, ','.join(keys), fmt))
+            else:
+                keys = None
+                layout.append('%s:%s' % (field, fmt))
+            self.fields_.append((path, keys, fmt))
+            formats.append(fmt)
+        self.layout = '\n'.join(layout)
+        self.layout_id = zlib.crc32(self.layout.encode('utf-8'))
+        self.values_ = struct.Struct('<' + ''.join(formats))
+        # A dict field has one value per key
+        self.value_count_ = sum(len(fmt) for fmt in formats)
+
+        self.socket_ = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Stay on the LAN
+        self.socket_.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+
+    def run(self):
+        shared_data = self.shared_data_
+        last_sequence = None
+        send_failed = False
+        pack_failed = False
+        while not self.stop_event_.is_set():
+            with shared_data['condition']:
+                # Wait for the next update
+                if (shared_data['sequence'] == last_sequence and
+                    not self.stop_event_.is_set()):
+                    shared_data['condition'].wait(1.0)
+                if shared_data['sequence'] == last_sequence:
+                    continue
+                last_sequence = shared_data['sequence']
+                try:
+                    frame = self.pack(shared_data['telemetry_data'])
+                    pack_failed = False
+                except (KeyError, TypeError, ValueError, struct.error) as e:
+                    # A value does not match the layout. Skip this update,
+                    # but keep sending later ones.
+                    if not pack_failed:
+                        self.logger_.warning("Failed to pack UDP frame: %r",
+                                             e)
+                        pack_failed = True
+                    continue
+
+            try:
+                self.socket_.sendto(frame, self.address_)
+                send_failed = False
+            except OSError as e:
+                # Only log the first failure, e.g. when the network is down
+                if not send_failed:
+                    self.logger_.warning("Failed to send UDP frame: %s", e)
+                    send_failed = True
+            self.stop_event_.wait(self.interval_)
+
+    def pack(self, telemetry_data):
+        values = []
+        for path, keys, fmt in self.fields_:
+            value = telemetry_data
+            for key in path:
+                value = value[key]
+            if keys is not None:
+                items = [ value[key] for key in keys ]
+            else:
+                items = (value,)
+            for value_fmt, item in zip(fmt, items):
+                values.append(CONVERTERS[value_fmt](item))
+        self.sequence_ = (self.sequence_ + 1) & 0xffffffff
+        return (HEADER.pack(FRAME_MAGIC, FRAME_VERSION, self.value_count_,
+                            self.layout_id, self.sequence_) +
+                self.values_.pack(*values))
+
+    def stop(self):
+        self.stop_event_.set()
+        with self.shared_data_['condition']:
+            self.shared_data_['condition'].notify_all()
+
+    def close(self):
+        self.socket_.close()
@@ -0,0 +1,136 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Running trip/job statistics, updated from the channel values.
+#
+# Every update is O(1). The results are kept in the "data" dict, which
+# is published as the "stats" subtree of the telemetry data.
+
+from datetime import timedelta
+
+# Below this speed (m/s), the truck is considered standing still
+IDLE_SPEED = 0.5
+# Game time runs this much faster than real time, until the game tells
+# otherwise
+DEFAULT_TIME_SCALE = 19.0
+# Game time is updated once per game minute. Larger steps are sleeping,
+# ferries or trains, when the truck is not driven.
+MAX_GAME_MINUTES_STEP = 5
+
+class TripStats:
+    def __init__(self):
+        self.data = {}
+        # Current values, kept across resets
+        self.speed_ = 0.0
+        self.time_scale_ = DEFAULT_TIME_SCALE
+        self.game_time_ = None
+        self.navigation_time_ = None
+        self.reset()
+
+    def reset(self):
+        """Starts over. Called when a new job is configured."""
+        self.start_odometer_ = None
+        self.distance_ = 0.0
+        self.last_fuel_ = None
+        self.fuel_used_ = 0.0
+        self.last_game_time_ = self.game_time_
+        # Real time, in seconds
+        self.driving_seconds_ = 0.0
+        self.idle_seconds_ = 0.0
+        self.delivery_time_ = None
+
+        self.data['distance'] = 0.0
+        self.data['fuelUsed'] = 0.0
+        self.data['fuelConsumption'] = 0.0
+        self.data['averageSpeed'] = 0.0
+        self.data['drivingTime'] = 0.0
+        self.data['idleTime'] = 0.0
+        self.data['onTime'] = True
+        self.data['deliveryMargin'] = 0.0
+
+    def update_odometer(self, km):
+        if self.start_odometer_ is None:
+            self.start_odometer_ = km
+        self.distance_ = km - self.start_odometer_
+        self.data['distance'] = self.distance_
+        self._update_consumption()
+        self._update_average_speed()
+
+    def update_fuel(self, litres):
+        # Only count decreases, so that refuelling is not counted as
+        # negative consumption
+        if self.last_fuel_ is not None and litres < self.last_fuel_:
+            self.fuel_used_ += self.last_fuel_ - litres
+            self.data['fuelUsed'] = self.fuel_used_
+            self._update_consumption()
+        self.last_fuel_ = litres
+
+    def update_speed(self, mps):
+        self.speed_ = mps
+
+    def update_time_scale(self, scale):
+        if scale > 0:
+            self.time_scale_ = scale
+
+    def update_game_time(self, game_time):
+        """game_time: datetime. The game only updates it once per game minute."""
+        self.game_time_ = game_time
+        if self.last_game_time_ is not None:
+            minutes = (game_time - self.last_game_time_) // timedelta(minutes=1)
+            if 0 < minutes <= MAX_GAME_MINUTES_STEP:
+                # Game time is compressed. Convert to real time, so that
+                # the average speed matches the km/h of the speedometer.
+                seconds = 60.0 * minutes / self.time_scale_
+                if abs(self.speed_) < IDLE_SPEED:
+                    self.idle_seconds_ += seconds
+                    self.data['idleTime'] = self.idle_seconds_
+                else:
+                    self.driving_seconds_ += seconds
+                    self.data['drivingTime'] = self.driving_seconds_
+                self._update_average_speed()
+        self.last_game_time_ = game_time
+        self._update_delivery_estimate()
+
+    def update_navigation_time(self, seconds):
+        self.navigation_time_ = seconds
+        self._update_delivery_estimate()
+
+    def set_delivery_time(self, delivery_time):
+        self.delivery_time_ = delivery_time
+        self._update_delivery_estimate()
+
+    def _update_consumption(self):
+        if self.distance_ > 0:
+            self.data['fuelConsumption'] = (100.0 * self.fuel_used_ /
+                                            self.distance_)
+
+    def _update_average_speed(self):
+        if self.driving_seconds_ > 0:
+            self.data['averageSpeed'] = (3600.0 * self.distance_ /
+                                         self.driving_seconds_)
+
+    def _update_delivery_estimate(self):
+        if (self.delivery_time_ is None or self.game_time_ is None or
+            self.navigation_time_ is None):
+            return
+        arrival = self.game_time_ + timedelta(seconds=self.navigation_time_)
+        margin = (self.delivery_time_ - arrival) / timedelta(minutes=1)
+        self.data['deliveryMargin'] = margin
+        self.data['onTime'] = margin >= 0
@@ -0,0 +1,105 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# pyets2lib is only available inside the game, so it is replaced with a
+# minimal stand-in. This must be done before pytest imports the
+# repository's __init__.py.
+
+import importlib.util
+import logging
+import os
+import re
+import sys
+import types
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+PACKAGE_NAME = 'pyets2_telemetry_server'
+
+class Channel:
+    def __init__(self, name, indexed):
+        self.name = name
+        self.indexed = indexed
+
+def stub_pyets2lib():
+    scshelpers = types.ModuleType('pyets2lib.scshelpers')
+    scshelpers.log_exception = lambda e: logging.exception(e)
+
+    # Define every SCS name that the plug-in refers to
+    scsdefs = types.ModuleType('pyets2lib.scsdefs')
+    scsdefs.SCS_CHANNELS = []
+    with open(os.path.join(ROOT_DIR, '__init__.py')) as source_file:
+        names = set(re.findall(r'\bSCS_[A-Za-z0-9_]+', source_file.read()))
+    names.discard('SCS_CHANNELS')
+    for name in sorted(names):
+        if '_CHANNEL_' in name:
+            indexed = (('_wheel_' in name and 'wear' not in name) or
+                       name.endswith('hshifter_selector'))
+            value = Channel(name, indexed)
+            scsdefs.SCS_CHANNELS.append(value)
+        else:
+            value = name
+        setattr(scsdefs, name, value)
+
+    pyets2lib = types.ModuleType('pyets2lib')
+    pyets2lib.scshelpers = scshelpers
+    pyets2lib.scsdefs = scsdefs
+    sys.modules['pyets2lib'] = pyets2lib
+    sys.modules['pyets2lib.scshelpers'] = scshelpers
+    sys.modules['pyets2lib.scsdefs'] = scsdefs
+
+stub_pyets2lib()
+
+def import_plugin():
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(ROOT_DIR, '__init__.py'),
+        submodule_search_locations=[ROOT_DIR])
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+class InitParams:
+    class common:
+        logger = logging.getLogger('test')
+        game_id = 'eut2'
+        game_name = 'Euro Truck Simulator 2 1.35'
+
+    def register_for_event(self, event, callback, context):
+        pass
+
+    def register_for_channel(self, channel, callback, index):
+        pass
+
+@pytest.fixture
+def plugin(monkeypatch, tmp_path):
+    plugin = import_plugin()
+    monkeypatch.setattr(plugin.web_server.SignalrHttpServer, 'PORT_NUMBER', 0)
+    monkeypatch.setattr(plugin.web_server, 'SKINS_CACHE_FILE',
+                        str(tmp_path / 'skins_cache.json'))
+    yield plugin
+    for name in list(sys.modules):
+        if name == PACKAGE_NAME or name.startswith(PACKAGE_NAME + '.'):
+            del sys.modules[name]
+
+@pytest.fixture
+def init_params():
+    return InitParams()
@@ -0,0 +1,99 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+import http.client
+import importlib
+import json
+import logging
+import threading
+
+import pytest
+
+@pytest.fixture
+def aggregator(plugin):
+    return importlib.import_module(plugin.__name__ + '.aggregator')
+
+def driver_data(speed):
+    return { 'truck': { 'speed': speed, 'placement': { 'x': 1.0 } },
+             'job': {},
+             'navigation': {} }
+
+def test_document_since(aggregator):
+    table = aggregator.ConvoyTable(['Alice', 'Bob'])
+    table.update(0, driver_data(80))
+    table.update(1, driver_data(70))
+    assert table.publish(1)
+    assert not table.publish(2)
+
+    table.update(1, driver_data(75))
+    assert table.publish(2)
+
+    document = table.document(2)
+    assert document['sequence'] == 2
+    assert [ d['name'] for d in document['drivers'] ] == ['Alice', 'Bob']
+    assert document['drivers'][1]['speed'] == 75
+    assert document['drivers'][1]['placement'] == { 'x': 1.0 }
+    assert document['drivers'][1]['connected']
+
+    assert [ d['name'] for d in table.document(2, since=0)['drivers'] ] == [
+        'Alice', 'Bob']
+    assert [ d['name'] for d in table.document(2, since=1)['drivers'] ] == [
+        'Bob']
+    assert table.document(2, since=2)['drivers'] == []
+
+    # Disconnecting is a change
+    table.set_connected(0, False)
+    assert table.publish(3)
+    drivers = table.document(3, since=2)['drivers']
+    assert [ d['name'] for d in drivers ] == ['Alice']
+    assert not drivers[0]['connected']
+
+def test_since_ahead_returns_everything(aggregator):
+    table = aggregator.ConvoyTable(['Alice', 'Bob'])
+    table.update(0, driver_data(80))
+    table.update(1, driver_data(70))
+    table.publish(1)
+    shared_data = {
+        'condition': threading.Condition(),
+        'telemetry_data': {},
+        'sequence': 1,
+        'history': None,
+        'convoy': table
+    }
+    server = aggregator.ConvoyServer(logging.getLogger('test'), shared_data)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    try:
+        connection = http.client.HTTPConnection(
+            'localhost', server.server_address[1], timeout=5)
+        # E.g. a client that was connected before the aggregator restarted
+        connection.request('GET', '/convoy?since=100')
+        response = connection.getresponse()
+        document = json.loads(response.read().decode('utf-8'))
+        connection.close()
+    finally:
+        server.shutdown()
+        server_thread.join()
+        server.server_close()
+
+    assert response.status == 200
+    assert document['sequence'] == 1
+    assert len(document['drivers']) == 2
@@ -0,0 +1,78 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+import pytest
+
+def make_store(history, length, samples):
+    store = history.HistoryStore(['truck.speed'], length, 1.0)
+    for now, speed in samples:
+        store.sample({ 'truck': { 'speed': speed } }, now)
+    return store
+
+def test_all_samples_when_fewer_than_points(plugin):
+    store = make_store(plugin.history, 10,
+                       [ (t, 10.0 * t) for t in range(3) ])
+    assert store.query('truck.speed', points=300) == [
+        { 'time': 0.0, 'min': 0.0, 'max': 0.0, 'mean': 0.0 },
+        { 'time': 1.0, 'min': 10.0, 'max': 10.0, 'mean': 10.0 },
+        { 'time': 2.0, 'min': 20.0, 'max': 20.0, 'mean': 20.0 },
+    ]
+
+def test_samples_closer_than_interval_are_skipped(plugin):
+    store = make_store(plugin.history, 10,
+                       [ (0.0, 1.0), (0.5, 2.0), (1.0, 3.0) ])
+    assert [ b['mean'] for b in store.query('truck.speed') ] == [1.0, 3.0]
+
+def test_wraparound_keeps_newest_in_order(plugin):
+    store = make_store(plugin.history, 4,
+                       [ (t, float(t)) for t in range(7) ])
+    buckets = store.query('truck.speed')
+    assert [ b['time'] for b in buckets ] == [3.0, 4.0, 5.0, 6.0]
+    assert [ b['mean'] for b in buckets ] == [3.0, 4.0, 5.0, 6.0]
+
+def test_buckets(plugin):
+    store = make_store(plugin.history, 10,
+                       [ (t, float(t)) for t in range(13) ])
+    # Samples 3-12 are left. Each bucket gets five of them.
+    assert store.query('truck.speed', points=2) == [
+        { 'time': 3.0, 'min': 3.0, 'max': 7.0, 'mean': 5.0 },
+        { 'time': 8.0, 'min': 8.0, 'max': 12.0, 'mean': 10.0 },
+    ]
+    # Uneven buckets cover all samples
+    buckets = store.query('truck.speed', points=3)
+    assert len(buckets) == 3
+    assert buckets[0]['min'] == 3.0
+    assert buckets[-1]['max'] == 12.0
+
+def test_since(plugin):
+    store = make_store(plugin.history, 4,
+                       [ (t, float(t)) for t in range(7) ])
+    assert [ b['time'] for b in store.query('truck.speed', since=4.5) ] == [
+        5.0, 6.0]
+    assert [ b['time'] for b in store.query('truck.speed', since=5.0) ] == [
+        5.0, 6.0]
+    assert store.query('truck.speed', since=10.0) == []
+
+def test_empty_and_unknown_field(plugin):
+    store = make_store(plugin.history, 4, [])
+    assert store.query('truck.speed') == []
+    with pytest.raises(KeyError):
+        store.query('truck.fuel')
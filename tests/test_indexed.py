@@ -0,0 +1,58 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+import json
+
+def test_non_finite_values_are_skipped(plugin):
+    values = plugin.indexed.IndexedValues('f')
+    values.set_count(3)
+    values.set(0, 1.5)
+    values.set(0, float('nan'))
+    values.set(1, float('inf'))
+    values.set(2, float('-inf'))
+    assert values.to_json() == [1.5, 0.0, 0.0]
+    # Must be valid JSON for the client
+    json.dumps(values.to_json(), allow_nan=False)
+
+def configure_trailer(plugin, attributes):
+    plugin.event_cb(plugin.SCS_TELEMETRY_EVENT_configuration,
+                    { 'id': plugin.SCS_TELEMETRY_CONFIG_trailer,
+                      'attributes': attributes },
+                    None)
+
+def test_detached_trailer_has_no_wheels(plugin, init_params):
+    plugin.init_params_ = init_params
+    plugin.init_shared_data()
+    trailer = plugin.shared_data_['telemetry_data']['trailer']
+
+    configure_trailer(plugin, [
+        (plugin.SCS_TELEMETRY_CONFIG_ATTRIBUTE_wheel_count, None, 6) ])
+    for index in range(6):
+        plugin.channel_cb(plugin.SCS_TELEMETRY_TRAILER_CHANNEL_wheel_velocity,
+                          index, 2.0, None)
+    assert trailer['wheelVelocity'].to_json() == [2.0] * 6
+
+    configure_trailer(plugin, [])
+    assert trailer['wheelVelocity'].to_json() == []
+
+    # A new trailer does not show the old trailer's values
+    configure_trailer(plugin, [
+        (plugin.SCS_TELEMETRY_CONFIG_ATTRIBUTE_wheel_count, None, 4) ])
+    assert trailer['wheelVelocity'].to_json() == [0.0] * 4
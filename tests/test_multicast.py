@@ -0,0 +1,94 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+import logging
+import threading
+
+import pytest
+
+def make_publisher(multicast, telemetry_data, fields):
+    shared_data = {
+        'condition': threading.Condition(),
+        'telemetry_data': telemetry_data,
+        'sequence': 0,
+        'history': None
+    }
+    return multicast.MulticastPublisher(logging.getLogger('test'),
+                                        shared_data, fields,
+                                        '239.255.25.55', 25555, 30.0)
+
+def unpack(multicast, publisher, frame):
+    header = multicast.HEADER.unpack_from(frame)
+    values = publisher.values_.unpack_from(frame, multicast.HEADER.size)
+    return header, values
+
+def test_pack(plugin):
+    multicast = plugin.multicast
+    telemetry_data = {
+        'truck': { 'speed': 20.5, 'gear': 3, 'parkBrakeOn': False,
+                   'make': 'Volvo',
+                   'placement': { 'x': 1.0, 'y': 2.0, 'z': 3.0 } }
+    }
+    publisher = make_publisher(multicast, telemetry_data,
+                               ['truck.speed', 'truck.gear', 'truck.make',
+                                'truck.parkBrakeOn', 'truck.placement'])
+    try:
+        # Strings cannot be sent
+        assert publisher.layout == ('truck.speed:f\n'
+                                    'truck.gear:i\n'
+                                    'truck.parkBrakeOn:?\n'
+                                    'truck.placement{x,y,z}:fff')
+
+        # Later values can have another type or key order
+        telemetry_data['truck']['gear'] = 4.0
+        telemetry_data['truck']['parkBrakeOn'] = 1
+        telemetry_data['truck']['placement'] = { 'z': 30.0, 'x': 10.0,
+                                                 'y': 20.0 }
+        header, values = unpack(multicast, publisher,
+                                publisher.pack(telemetry_data))
+        assert header == (multicast.FRAME_MAGIC, multicast.FRAME_VERSION,
+                          6, publisher.layout_id, 1)
+        assert values == (20.5, 4, True, 10.0, 20.0, 30.0)
+
+        header, values = unpack(multicast, publisher,
+                                publisher.pack(telemetry_data))
+        assert header[4] == 2
+
+        # A missing key is not silently replaced
+        telemetry_data['truck']['placement'] = { 'x': 10.0, 'y': 20.0 }
+        with pytest.raises(KeyError):
+            publisher.pack(telemetry_data)
+    finally:
+        publisher.close()
+
+def test_layout_id_covers_keys(plugin):
+    multicast = plugin.multicast
+    first = make_publisher(multicast,
+                           { 'placement': { 'x': 1.0, 'y': 2.0 } },
+                           ['placement'])
+    second = make_publisher(multicast,
+                            { 'placement': { 'y': 2.0, 'x': 1.0 } },
+                            ['placement'])
+    try:
+        assert first.layout_id != second.layout_id
+    finally:
+        first.close()
+        second.close()
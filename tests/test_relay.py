@@ -0,0 +1,72 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+import logging
+import threading
+
+def test_subscriber_keeps_one_connection(plugin):
+    web_server = plugin.web_server
+    logger = logging.getLogger('test')
+    shared_data = {
+        'condition': threading.Condition(),
+        'telemetry_data': { 'game': { 'connected': True }, 'count': 0 },
+        'sequence': 0,
+        'history': None
+    }
+
+    accepted = []
+    class CountingServer(web_server.SignalrHttpServer):
+        def process_request(self, request, client_address):
+            accepted.append(client_address)
+            super().process_request(request, client_address)
+
+    server = CountingServer(logger, shared_data)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    received = []
+    received_event = threading.Event()
+    def on_data(telemetry_data):
+        received.append(telemetry_data['count'])
+        received_event.set()
+
+    subscriber = web_server.UpstreamSubscriber(
+        logger, 'localhost', server.server_address[1], on_data, lambda: None)
+    subscriber_thread = threading.Thread(target=subscriber.run)
+    subscriber_thread.start()
+    try:
+        for count in range(1, 4):
+            assert received_event.wait(5)
+            received_event.clear()
+            with shared_data['condition']:
+                shared_data['telemetry_data']['count'] = count
+                shared_data['sequence'] += 1
+                shared_data['condition'].notify_all()
+        assert received_event.wait(5)
+    finally:
+        subscriber.stop()
+        subscriber_thread.join()
+        server.shutdown()
+        server_thread.join()
+        server.server_close()
+
+    assert received == [0, 1, 2, 3]
+    assert len(accepted) == 1
@@ -0,0 +1,66 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Checks that quitting the game is not held up by connected clients.
+
+import http.client
+import time
+
+CLIENT_COUNT = 100
+SHUTDOWN_BUDGET = 0.2
+
+def poll(connection, token):
+    connection.request(
+        'POST',
+        '/signalr/poll?transport=longPolling&connectionToken=%u' % token,
+        'messageId=1',
+        { 'Content-Type': 'application/x-www-form-urlencoded' })
+
+def test_shutdown_with_long_poll_clients(plugin, init_params):
+    plugin.telemetry_init(1, init_params)
+    port = plugin.server_.server_address[1]
+
+    connections = []
+    try:
+        for token in range(CLIENT_COUNT):
+            connection = http.client.HTTPConnection('localhost', port,
+                                                    timeout=10)
+            connections.append(connection)
+            # The first poll of a new client returns the data immediately
+            poll(connection, token)
+            connection.getresponse().read()
+            # The second poll waits for new data
+            poll(connection, token)
+
+        # Wait until all polls are blocking in the server
+        deadline = time.monotonic() + 10
+        while len(plugin.server_._connections) < CLIENT_COUNT:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        time.sleep(0.2)
+
+        start = time.monotonic()
+        plugin.telemetry_shutdown()
+        elapsed = time.monotonic() - start
+    finally:
+        for connection in connections:
+            connection.close()
+
+    assert elapsed < SHUTDOWN_BUDGET
@@ -0,0 +1,53 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry_server.
+#
+# pyets2_telemetry_server is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pyets2_telemetry_server is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry_server.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+from datetime import datetime, timedelta
+
+import pytest
+
+START = datetime(1, 1, 1)
+
+def test_average_speed_in_real_time(plugin):
+    stats = plugin.stats.TripStats()
+    stats.update_time_scale(20.0)
+    stats.update_game_time(START)
+    stats.update_odometer(100.0)
+    stats.update_speed(22.2)
+    # One real minute at 80 km/h
+    for minute in range(1, 21):
+        stats.update_game_time(START + timedelta(minutes=minute))
+    stats.update_odometer(100.0 + 80.0 / 60)
+
+    assert stats.data['drivingTime'] == pytest.approx(60.0)
+    assert stats.data['idleTime'] == 0.0
+    assert stats.data['averageSpeed'] == pytest.approx(80.0)
+
+def test_sleeping_is_not_counted(plugin):
+    stats = plugin.stats.TripStats()
+    stats.update_time_scale(20.0)
+    stats.update_game_time(START)
+    stats.update_speed(0.0)
+    stats.update_game_time(START + timedelta(minutes=1))
+    # Nine hours of sleep
+    stats.update_game_time(START + timedelta(hours=9, minutes=1))
+    stats.update_game_time(START + timedelta(hours=9, minutes=2))
+
+    assert stats.data['idleTime'] == pytest.approx(6.0)
+    assert stats.data['drivingTime'] == 0.0
@@ -18,13 +18,23 @@
 # If not, see <https://www.gnu.org/licenses/>.
 #
 
+# This module can also be run stand-alone, as a relay that serves the
+# data of another pyets2_telemetry_server:
+#
+#   python3 web_server.py <UPSTREAM HOST>[:<PORT>] [--port <PORT>]
+#
+# Relays can be chained.
+
 # SignalR protocol info:
 # https://blog.3d-logic.com/2015/03/29/signalr-on-the-wire-an-informal-description-of-the-signalr-protocol/
 # http://www.mithril.com.au/SignalR%20Protocol.docx (old protocol version)
 
+import argparse
 import http
+import http.client
 import http.server
 import json
+import logging
 import os
 import posixpath
 import socket
@@ -32,12 +42,27 @@ import socketserver
 import threading
 import urllib
 
-import pyets2lib.scshelpers
+try:
+    import pyets2lib.scshelpers
+    log_exception = pyets2lib.scshelpers.log_exception
+except ImportError:
+    # Running as a relay, outside of the game
+    def log_exception(e):
+        logging.getLogger(__name__).error("Exception", exc_info=e)
 
 MODULE_DIR = os.path.dirname(os.path.realpath(__file__))
 HTML_DIR = 'Html'
-
-config_json = None
+SKINS_DIR = os.path.join(MODULE_DIR, HTML_DIR, 'skins')
+# Parsed skin configs, to avoid parsing all skins at every start
+SKINS_CACHE_FILE = os.path.join(MODULE_DIR, 'skins_cache.json')
+# Seconds between checks for added/changed skins
+SKINS_SCAN_INTERVAL = 5.0
+# Seconds to wait for the first skin scan, when /config.json is requested
+SKINS_READY_TIMEOUT = 5.0
+# Seconds between shutdown checks in serve_forever()
+SERVE_POLL_INTERVAL = 0.05
+
+config_json = json.dumps({ 'skins': [] })
 
 negotiate_base = {
     'Url': '/signalr',
@@ -67,16 +92,47 @@ poll_keepalive_json = json.dumps({})
 
 pong_json = json.dumps({ 'Response': 'pong' })
 
+def json_default(obj):
+    # Objects in the telemetry data that are not plain JSON types,
+    # e.g. IndexedValues, know how to serialize themselves.
+    to_json = getattr(obj, 'to_json', None)
+    if to_json is None:
+        raise TypeError("Object of type %s is not JSON serializable" %
+                        type(obj).__name__)
+    return to_json()
 
 
 class SignalrHandler(http.server.SimpleHTTPRequestHandler):
+    # Drop connections from clients that disappear without closing.
+    # Must be longer than the poll wait.
+    timeout = 30
+    # Keep connections open between requests. Must be set before the
+    # first request is handled, i.e. before BaseHTTPRequestHandler.__init__.
+    protocol_version = 'HTTP/1.1'
+
     def __init__(self, logger, shared_data, stop_event,
                  request, client_address, server):
         self.logger_ = logger
         self.shared_data_ = shared_data
         self.stop_event_ = stop_event
+        self.content_length_sent_ = True
         super().__init__(request, client_address, server)
-        self.protocol_version = 'HTTP/1.1'
+
+    # A response without Content-Length, e.g. a redirect from the Python
+    # 3.6 file server, can only be ended by closing the connection
+    def send_response(self, code, message=None):
+        self.content_length_sent_ = False
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self.content_length_sent_ = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if not self.content_length_sent_ and not self.close_connection:
+            self.send_header('Connection', 'close')
+        super().end_headers()
 
     # SimpleHTTPRequestHandler log function
     def log_message(self, format, *args):
@@ -136,20 +192,29 @@ class SignalrHandler(http.server.SimpleHTTPRequestHandler):
     def do_signalr(self):
         try:
             return self.do_signalr_comm()
-        except BrokenPipeError:
+        except (BrokenPipeError, ConnectionResetError):
             # Client closed connection. Most likely left the web page.
             return True
+        except OSError:
+            if self.stop_event_.is_set():
+                # Connection closed by shutdown()
+                return True
+            raise
         except Exception as e:
             # Each request is handled in a new thread, so we need to set up
             # exception logging
-            pyets2lib.scshelpers.log_exception(e)
+            log_exception(e)
             raise
 
     def do_signalr_comm(self):
         processed = True
         if self.path.startswith('/config.json'):
             self.read_data()
+            self.server.skins_ready_.wait(SKINS_READY_TIMEOUT)
             self.write_response(config_json)
+        elif self.path.startswith('/history'):
+            self.read_data()
+            self.write_history()
         elif self.path.startswith('/signalr/hubs'):
             # This response is too complex. Handing over to the file server.
             processed = False
@@ -190,6 +255,7 @@ class SignalrHandler(http.server.SimpleHTTPRequestHandler):
 
             query = self.parse_query()
             token = query['connectionToken'][0]
+            client = self.server.get_client(token)
             new_client = self.server.test_and_set_client_new(token, False)
             
             telemetry_data = None
@@ -199,14 +265,15 @@ class SignalrHandler(http.server.SimpleHTTPRequestHandler):
                 # wait() can release early, but we don't know how much
                 # time that has passed, so we continue, to avoid waiting
                 # too long before sending a keep-alive to the client.
-                if (not shared_data['new_data'] and
+                if (shared_data['sequence'] == client.sequence and
                     not self.stop_event_.is_set() and
                     not new_client):
                     shared_data['condition'].wait(10.0)
-                if shared_data['new_data'] or new_client:
-                    shared_data['new_data'] = False
+                if shared_data['sequence'] != client.sequence or new_client:
+                    client.sequence = shared_data['sequence']
                     # Copy the data
-                    telemetry_data = json.dumps(shared_data['telemetry_data'])
+                    telemetry_data = json.dumps(shared_data['telemetry_data'],
+                                                default=json_default)
 
             if telemetry_data:
                 poll_json = json.dumps(
@@ -234,20 +301,58 @@ class SignalrHandler(http.server.SimpleHTTPRequestHandler):
 
             # TODO: if method == RequestData
 
+            token = self.parse_query().get('connectionToken')
+            client = self.server.get_client(token[0]) if token else None
+
             shared_data = self.shared_data_
             with shared_data['condition']:
-                shared_data['new_data'] = False
+                if client is not None:
+                    # Don't send the same data again in the next poll
+                    client.sequence = shared_data['sequence']
                 # Copy the data
                 resp = { 'I': id,
                          'R': shared_data['telemetry_data'] }
-                resp_json = json.dumps(resp)
+                resp_json = json.dumps(resp, default=json_default)
             self.write_response(resp_json)
         else:
             processed = False
             
         return processed
 
-        
+    def write_history(self):
+        history = self.shared_data_['history']
+        if history is None:
+            self.write_response('', code=http.HTTPStatus.NOT_FOUND)
+            return
+
+        query = self.parse_query()
+        field = query.get('field', [None])[0]
+        if field is None:
+            self.write_response(json.dumps({ 'fields': history.fields() }))
+            return
+        try:
+            since = query.get('since')
+            if since is not None:
+                since = float(since[0])
+            points = int(query.get('points', ['300'])[0])
+        except ValueError:
+            self.write_response('', code=http.HTTPStatus.BAD_REQUEST)
+            return
+        if points < 1:
+            self.write_response('', code=http.HTTPStatus.BAD_REQUEST)
+            return
+
+        with self.shared_data_['condition']:
+            try:
+                buckets = history.query(field, since, points)
+            except KeyError:
+                buckets = None
+        if buckets is None:
+            self.write_response('', code=http.HTTPStatus.NOT_FOUND)
+        else:
+            self.write_response(json.dumps({ 'field': field,
+                                             'buckets': buckets }))
+
     def read_data(self):
         length = self.headers['Content-Length']
         if length is None:
@@ -276,43 +381,130 @@ class SignalrHttpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     # deamon_threads leads to crashes in the C++ process..
     # Doing manual handling with Events, for now.
     # daemon_threads = True
+    handler_class = SignalrHandler
 
-    def __init__(self, logger, shared_data):
+    def __init__(self, logger, shared_data, port=None):
+        if port is None:
+            port = self.PORT_NUMBER
         self.logger_ = logger
         self.stop_event_ = threading.Event()
         self.shared_data_ = shared_data
-        self.collect_skins()
+        self.skins_ready_ = threading.Event()
+        # Skin config cache: { skin name: (config.json mtime, config) }
+        # config is None if config.json could not be parsed
+        self.skins_ = {}
 
         # State
         self._state_lock = threading.RLock()
         self._token_counter = 0
         self._clients = {}
+        # Sockets of connections that are being handled
+        self._connections = set()
 
-        # Make sure code does not get stuck in blocking read when trying to exit
-        socket.setdefaulttimeout(1)
-        
         def handler(*args):
-            return SignalrHandler(logger, shared_data, self.stop_event_, *args)
-        super().__init__(('', SignalrHttpServer.PORT_NUMBER), handler)
+            return self.handler_class(logger, shared_data, self.stop_event_,
+                                      *args)
+        super().__init__(('', port), handler)
+
+        # Collecting the skins takes time, so don't do it while the game
+        # is waiting for the plug-in to load.
+        self.skin_thread_ = threading.Thread(target=self.watch_skins)
+        self.skin_thread_.name = "skin watcher"
+        self.skin_thread_.start()
+
+    def watch_skins(self):
+        try:
+            self.load_skins_cache()
+            while True:
+                if self.collect_skins():
+                    self.save_skins_cache()
+                self.skins_ready_.set()
+                if self.stop_event_.wait(SKINS_SCAN_INTERVAL):
+                    break
+        except Exception as e:
+            log_exception(e)
+            self.skins_ready_.set()
 
     def collect_skins(self):
+        """Updates config_json with added, removed or changed skins.
+
+        Returns True if anything changed.
+        """
         global config_json
-        skin_configs = []
-        skins_dir = os.path.join(MODULE_DIR, HTML_DIR, 'skins')
-        for d in os.scandir(skins_dir):
+        skins = {}
+        changed = False
+        for d in os.scandir(SKINS_DIR):
+            if self.stop_event_.is_set():
+                # Don't delay shutdown. The scan is redone at next start.
+                return False
             if not d.is_dir():
                 continue
-            with open(d.path + '/config.json') as config_file:
-                try:
+            filename = os.path.join(d.path, 'config.json')
+            try:
+                mtime = os.stat(filename).st_mtime_ns
+            except OSError:
+                continue
+            cached = self.skins_.get(d.name)
+            if cached is not None and cached[0] == mtime:
+                skins[d.name] = cached
+                continue
+            changed = True
+            try:
+                with open(filename) as config_file:
                     skin = json.load(config_file)
-                except:
-                    self.logger_.warning("Failed to parse %s" % filename)
-                    continue
                 # Make sure name has the correct casing
                 skin_config = skin['config']
                 skin_config['name'] = d.name
-                skin_configs.append(skin_config)
-        config_json = json.dumps( { 'skins': skin_configs } )
+            except Exception:
+                self.logger_.warning("Failed to parse %s" % filename)
+                # Remember the failure, to not parse it again until the
+                # file changes
+                skin_config = None
+            skins[d.name] = (mtime, skin_config)
+
+        changed = changed or skins.keys() != self.skins_.keys()
+        # The first scan must always publish the skins, as they might
+        # all have come from the cache
+        if changed or not self.skins_ready_.is_set():
+            self.skins_ = skins
+            config_json = json.dumps(
+                { 'skins': [ skin_config for name, (mtime, skin_config)
+                             in sorted(skins.items())
+                             if skin_config is not None ] })
+        return changed
+
+    def load_skins_cache(self):
+        try:
+            with open(SKINS_CACHE_FILE) as cache_file:
+                self.skins_ = { name: tuple(entry) for name, entry
+                                in json.load(cache_file).items() }
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self.logger_.warning("Failed to load %s" % SKINS_CACHE_FILE)
+
+    def save_skins_cache(self):
+        try:
+            with open(SKINS_CACHE_FILE, 'w') as cache_file:
+                json.dump(self.skins_, cache_file)
+        except OSError:
+            self.logger_.warning("Failed to save %s" % SKINS_CACHE_FILE)
+
+    def serve_forever(self, poll_interval=SERVE_POLL_INTERVAL):
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        with self._state_lock:
+            if self.stop_event_.is_set():
+                self.shutdown_request(request)
+                return
+            self._connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self._state_lock:
+            self._connections.discard(request)
+        super().shutdown_request(request)
 
     def add_client(self, token=None):
         with self._state_lock:
@@ -326,6 +518,8 @@ class SignalrHttpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
             state = ClientState()
             state.token = token
             state.new = True
+            # Last sent shared_data sequence number
+            state.sequence = None
             self._clients[token] = state
             return state.token
     
@@ -336,6 +530,10 @@ class SignalrHttpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
             client = self._clients.get(token)
         return client
 
+    def get_client(self, token):
+        with self._state_lock:
+            return self._get_client(token)
+
     def remove_client(self, token):
         with self._state_lock:
             if token in self._clients:
@@ -353,10 +551,159 @@ class SignalrHttpServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         super().shutdown()
 
         # Make sure existing connections tear down
-        self.stop_event_.set()
+        with self._state_lock:
+            self.stop_event_.set()
+            connections = list(self._connections)
         # Cancel the polling, to avoid blocking
         with self.shared_data_['condition']:
             self.shared_data_['condition'].notify_all()
+        # Wake up handlers blocked in reads or writes
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Already closed
+                pass
+
+        self.skin_thread_.join()
 
 class ClientState:
     pass
+
+class UpstreamSubscriber:
+    """Long-polls the telemetry data from another
+    pyets2_telemetry_server, over a single connection."""
+    # Longer than the upstream poll wait
+    TIMEOUT = 15.0
+    RETRY_DELAY = 2.0
+
+    def __init__(self, logger, host, port, on_data, on_disconnect):
+        """on_data: Called with the telemetry data dict on every update
+        on_disconnect: Called when the connection is lost
+        """
+        self.logger_ = logger
+        self.host_ = host
+        self.port_ = port
+        self.on_data_ = on_data
+        self.on_disconnect_ = on_disconnect
+        self.stop_event_ = threading.Event()
+        self.connection_ = None
+
+    def run(self):
+        while not self.stop_event_.is_set():
+            try:
+                self.subscribe()
+            except (OSError, http.client.HTTPException,
+                    ValueError, KeyError) as e:
+                if self.stop_event_.is_set():
+                    break
+                self.logger_.warning("Lost connection to %s:%u: %s",
+                                     self.host_, self.port_, e)
+            finally:
+                if self.connection_ is not None:
+                    self.connection_.close()
+                    self.connection_ = None
+            self.on_disconnect_()
+            self.stop_event_.wait(self.RETRY_DELAY)
+
+    def stop(self):
+        self.stop_event_.set()
+        # Wake up a blocking poll
+        connection = self.connection_
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def subscribe(self):
+        self.connection_ = http.client.HTTPConnection(
+            self.host_, self.port_, timeout=self.TIMEOUT)
+        negotiate = self.request('/signalr/negotiate', '')
+        token = urllib.parse.quote(negotiate['ConnectionToken'])
+        self.logger_.info("Connected to %s:%u", self.host_, self.port_)
+
+        message_id = '0'
+        while not self.stop_event_.is_set():
+            poll = self.request(
+                '/signalr/poll?transport=longPolling&connectionToken=' + token,
+                urllib.parse.urlencode({ 'messageId': message_id }))
+            # Empty response is a keep-alive
+            message_id = poll.get('C', message_id)
+            for message in poll.get('M', []):
+                if message['M'] == 'UpdateData':
+                    self.on_data_(json.loads(message['A'][0]))
+
+    def request(self, path, body):
+        self.connection_.request(
+            'POST', path, body,
+            { 'Content-Type': 'application/x-www-form-urlencoded' })
+        response = self.connection_.getresponse()
+        data = response.read()
+        if response.status != http.HTTPStatus.OK:
+            raise http.client.HTTPException(
+                "%s returned %u" % (path, response.status))
+        return json.loads(data.decode('utf-8'))
+
+def parse_address(address):
+    host, _, port = address.partition(':')
+    return host, int(port) if port else SignalrHttpServer.PORT_NUMBER
+
+def run_relay(upstream, port):
+    logger = logging.getLogger('relay')
+    shared_data = {
+        'condition': threading.Condition(),
+        'telemetry_data': { 'game': { 'connected': False } },
+        'sequence': 0,
+        'history': None
+    }
+
+    def on_data(telemetry_data):
+        with shared_data['condition']:
+            shared_data['telemetry_data'] = telemetry_data
+            shared_data['sequence'] += 1
+            shared_data['condition'].notify_all()
+
+    def on_disconnect():
+        with shared_data['condition']:
+            if shared_data['telemetry_data']['game'].get('connected'):
+                shared_data['telemetry_data']['game']['connected'] = False
+                shared_data['sequence'] += 1
+                shared_data['condition'].notify_all()
+
+    # Bind first, so that a port in use fails before any thread is running
+    server = SignalrHttpServer(logger, shared_data, port)
+
+    host, upstream_port = parse_address(upstream)
+    subscriber = UpstreamSubscriber(logger, host, upstream_port,
+                                    on_data, on_disconnect)
+    subscriber_thread = threading.Thread(target=subscriber.run)
+    subscriber_thread.name = "upstream subscriber"
+    subscriber_thread.start()
+
+    logger.info("Relaying %s:%u on port %u", host, upstream_port, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.stop()
+        subscriber_thread.join()
+        server.shutdown()
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Relay the telemetry data of another "
+                    "pyets2_telemetry_server.")
+    parser.add_argument('upstream', help="HOST[:PORT] of the server to relay")
+    parser.add_argument('--port', type=int,
+                        default=SignalrHttpServer.PORT_NUMBER,
+                        help="Port to serve on (default: %(default)s)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    run_relay(args.upstream, args.port)
+
+if __name__ == '__main__':
+    main()